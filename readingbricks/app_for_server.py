@@ -8,6 +8,15 @@ Author: Nikolay Lysenko
 
 
 from readingbricks import app
+from readingbricks.views import prerender_all_notes
+
+
+# Templates do not change while the app is running on a server,
+# so they should be compiled once and never re-checked.
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+app.jinja_env.auto_reload = False
+
+prerender_all_notes()
 
 
 if __name__ == '__main__':
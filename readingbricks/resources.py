@@ -12,6 +12,7 @@ Author: Nikolay Lysenko
 """
 
 
+import json
 import sqlite3
 import os
 from collections import defaultdict
@@ -25,8 +26,8 @@ class DatabaseCreator:
     """
     Creator of SQLite database mapping a tag to a list of notes.
 
-    Namely, tables from the database represent tags and rows of a table
-    represent notes tagged with the corresponding tag.
+    Namely, there is a single table named `tag_to_notes` and each of
+    its rows relates a note to one of the tags of this note.
 
     :param path_to_ipynb_notes:
         path to directory where Jupyter files with notes are located
@@ -60,25 +61,24 @@ class DatabaseCreator:
         # Write content of `tag_to_notes` to the target DB.
         with closing(sqlite3.connect(self.__path_to_db)) as conn:
             with utils.open_transaction(conn) as cur:
+                cur.execute(
+                    "DROP TABLE IF EXISTS tag_to_notes"
+                )
+                cur.execute(
+                    """
+                    CREATE TABLE tag_to_notes (
+                        tag VARCHAR NOT NULL,
+                        note_id VARCHAR NOT NULL,
+                        PRIMARY KEY (tag, note_id)
+                    ) WITHOUT ROWID
+                    """
+                )
                 for k, v in tag_to_notes.items():
-                    cur.execute(
-                        f"CREATE TABLE IF NOT EXISTS {k} (note_id VARCHAR)"
-                    )
-                    cur.execute(
-                        f"""
-                        CREATE UNIQUE INDEX IF NOT EXISTS
-                            {k}_index
-                        ON
-                            {k} (note_id)
-                        """
-                    )
-                    cur.execute(
-                        f"DELETE FROM {k}"
-                    )
                     for note_title in v:
                         cur.execute(
-                            f"INSERT INTO {k} (note_id) VALUES (?)",
-                            (utils.compress(note_title),)
+                            "INSERT INTO tag_to_notes (tag, note_id) "
+                            "VALUES (?, ?)",
+                            (k, utils.compress(note_title))
                         )
             with closing(conn.cursor()) as cur:
                 cur.execute('VACUUM')
@@ -175,6 +175,22 @@ class MarkdownDirectoryCreator:
             self.__copy_cell_content_to_markdown_file(cell)
 
 
+def take_snapshot_of_ipynb_notes(ipynb_path: str) -> Dict[str, int]:
+    """
+    Map names of Jupyter files to their modification times.
+
+    :param ipynb_path:
+        path to directory where Jupyter files with notes are located
+    :return:
+        mapping from file name to its modification time in nanoseconds
+    """
+    return {
+        entry.name: entry.stat().st_mtime_ns
+        for entry in os.scandir(ipynb_path)
+        if entry.is_file() and entry.name.endswith('.ipynb')
+    }
+
+
 def provide_resources(
         ipynb_path: Optional[str] = None,
         markdown_path: Optional[str] = None,
@@ -183,6 +199,10 @@ def provide_resources(
     """
     Create or update all resources.
 
+    If no Jupyter file has been changed since the previous run
+    (according to a manifest with modification times), existing
+    resources are kept as is and nothing is rebuilt.
+
     :return:
         None
     """
@@ -190,10 +210,19 @@ def provide_resources(
     markdown_path = markdown_path or settings.get_path_to_markdown_notes()
     db_path = db_path or settings.get_path_to_db()
 
+    snapshot = take_snapshot_of_ipynb_notes(ipynb_path)
+    manifest_path = os.path.join(markdown_path, '.manifest.json')
+    if os.path.isfile(db_path) and os.path.isfile(manifest_path):
+        with open(manifest_path) as manifest_file:
+            if json.load(manifest_file) == snapshot:
+                return
+
     md_creator = MarkdownDirectoryCreator(ipynb_path, markdown_path)
     md_creator.create_or_update_directory_with_markdown_notes()
     db_creator = DatabaseCreator(ipynb_path, db_path)
     db_creator.create_or_update_db()
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(snapshot, manifest_file)
 
 
 if __name__ == '__main__':
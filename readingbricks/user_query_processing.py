@@ -5,19 +5,21 @@ Author: Nikolay Lysenko
 """
 
 
+import re
 import sqlite3
-import contextlib
-import string
-from typing import List
+from typing import Any, List, Tuple
 
 import pyparsing as pp
 
 
+SINGLE_TAG_PATTERN = re.compile(r'[A-Za-z_\u0080-\u07ff]+')
+
+
 class LogicalQueriesHandler:
     """
     Processor of queries that returns list of matching notes.
 
-    A query of a special form is converted to SQL statement,
+    A query of a special form is compiled into a single SQL statement,
     database interaction starts, and list of matching notes
     is returned as a result.
 
@@ -29,18 +31,20 @@ class LogicalQueriesHandler:
     "neural networks" tag and at least one of "problem_setup" and
     "bayesian_methods" tags.
 
-    :param path_to_db:
-        absolute path to SQLite database with tables representing tags
-        and rows representing notes
+    :param connection:
+        connection to SQLite database with `tag_to_notes` table
+        that maps a tag to notes tagged with it
     """
 
-    def __init__(self, path_to_db: str):
+    def __init__(self, connection: sqlite3.Connection):
         """Initialize an instance."""
-        self.__path_to_db = path_to_db
+        self.__connection = connection
 
     @staticmethod
-    def __infer_precedence(user_query: str) -> str:
-        # Put square brackets that indicate precedence of operations.
+    def __parse_query(user_query: str) -> Any:
+        # Parse user query into a tree with precedence of operations
+        # resolved. Nodes of the tree are `pyparsing.ParseResults`
+        # and its leaves are tags as strings.
         extra_chars = pp.srange(r"[\0x80-\0x7FF]")  # Support Cyrillic letters.
         tag = pp.Word(pp.alphas + '_' + extra_chars)
         parser = pp.operatorPrecedence(
@@ -51,107 +55,87 @@ class LogicalQueriesHandler:
                 ("OR", 2, pp.opAssoc.LEFT)
             ]
         )
-        parsed_expression = parser.parseString(user_query)[0]
-        return str(parsed_expression)
-
-    @staticmethod
-    def __compose_sql_query(operator: str, operands: List[str]) -> str:
-        # Turn logical operation into SQL query that performs it.
-        if operator == 'AND':
-            operands_and_aliases = list(zip(operands, string.ascii_lowercase))
-            query = (
-                f'''
-                SELECT
-                    a.note_id
-                FROM
-                    {operands[0]} a
-                '''
-                + '\n'.join(
-                    [
-                        f'''
-                        JOIN
-                        {operand} {alias}
-                        ON
-                            a.note_id = {alias}.note_id
-                        '''
-                        for operand, alias in operands_and_aliases[1:]
-                    ]
-                )
+        return parser.parseString(user_query)[0]
+
+    def __collect_tags(self, node: Any) -> List[str]:
+        # Gather all tags mentioned in a parsed query.
+        if isinstance(node, str):
+            return [node]
+        items = list(node)
+        children = items[1:2] if items[0] == 'NOT' else items[::2]
+        return [
+            tag
+            for child in children
+            for tag in self.__collect_tags(child)
+        ]
+
+    def __validate_tags(self, tags: List[str]) -> None:
+        # Check that every tag really exists.
+        for tag in tags:
+            cur = self.__connection.execute(
+                "SELECT 1 FROM tag_to_notes WHERE tag = ? LIMIT 1",
+                (tag,)
             )
-        elif operator == 'OR':
-            query = (
-                "UNION".join(
-                    [
-                        f'''
-                        SELECT
-                            note_id
-                        FROM
-                            {operand}
-                        '''
-                        for operand in operands
-                    ]
-                )
+            if cur.fetchone() is None:
+                raise sqlite3.OperationalError(f"No such tag: {tag}")
+
+    def __compile_or(self, children: List[Any]) -> Tuple[str, List[str]]:
+        # Compile an OR node. All children that are plain tags are
+        # squeezed into a single `IN` clause, so they are processed
+        # by one index lookup per tag; `DISTINCT` deduplicates notes
+        # that have several of the listed tags.
+        selects = []
+        params = []
+        tags = [child for child in children if isinstance(child, str)]
+        for child in children:
+            if isinstance(child, str):
+                continue
+            sub_query, sub_params = self.__compile_node(child)
+            selects.append(f"SELECT note_id FROM ({sub_query})")
+            params.extend(sub_params)
+        if tags:
+            placeholders = ', '.join('?' for _ in tags)
+            selects.append(
+                "SELECT DISTINCT note_id FROM tag_to_notes "
+                f"WHERE tag IN ({placeholders})"
             )
-        elif operator == 'NOT':
+            params.extend(tags)
+        return " UNION ".join(selects), params
+
+    def __compile_node(self, node: Any) -> Tuple[str, List[str]]:
+        # Recursively compile a parsed query into a single SQL query
+        # with set operations and parameters bound to tags.
+        if isinstance(node, str):
+            return "SELECT note_id FROM tag_to_notes WHERE tag = ?", [node]
+        items = list(node)
+        if items[0] == 'NOT':
+            sub_query, params = self.__compile_node(items[1])
             query = (
-                f'''
-                SELECT
-                    *
-                FROM
-                    all_notes a
-                WHERE
-                    NOT EXISTS(
-                        SELECT
-                            *
-                        FROM
-                            {operands[0]} b
-                        WHERE
-                            a.note_id = b.note_id
-                    )
-                '''
+                "SELECT note_id FROM tag_to_notes WHERE tag = 'all_notes' "
+                f"EXCEPT SELECT note_id FROM ({sub_query})"
             )
-        else:
-            raise ValueError(f"Unknown operator: {operator}")
-        return query
-
-    def __create_tmp_table(self, leaf: List[str], cur: sqlite3.Cursor) -> str:
-        # Create temporary table for a single leaf.
-        # Here, leaf means a part of the parsed user query without any
-        # nested parts in it and a part means anything that is inside
-        # square brackets.
-        if 'NOT' in leaf:
-            operator = 'NOT'
-            operands = [leaf[1]]
-        else:
-            operator = leaf[1]
-            operands = leaf[::2]
-        query = self.__compose_sql_query(operator, operands)
-        tmp_table_name = '_'.join(leaf)
-        cur.execute(f"CREATE TEMP TABLE {tmp_table_name} AS {query}")
-        cur.execute(
-            f'''
-            CREATE UNIQUE INDEX IF NOT EXISTS
-                {tmp_table_name}_index ON {tmp_table_name} (note_id)
-            '''
+            return query, params
+        if items[1] == 'OR':
+            return self.__compile_or(items[::2])
+        selects = []
+        params = []
+        for child in items[::2]:
+            sub_query, sub_params = self.__compile_node(child)
+            selects.append(f"SELECT note_id FROM ({sub_query})")
+            params.extend(sub_params)
+        return " INTERSECT ".join(selects), params
+
+    def __find_notes_by_single_tag(self, tag: str) -> List[str]:
+        # Select notes for a query that consists of exactly one tag.
+        # Such queries are frequent and they can be run directly,
+        # without query parsing.
+        self.__validate_tags([tag])
+        cur = self.__connection.execute(
+            "SELECT note_id FROM tag_to_notes WHERE tag = ?",
+            (tag,)
         )
-        return f"'{tmp_table_name}'"
-
-    def __replace_leaf_with_tmp_table(
-            self,
-            parsed_query: str,
-            cur: sqlite3.Cursor
-    ) -> str:
-        # Create a temporary table for a single leaf and return a query
-        # where this leaf is replaced with the name of the temporary table.
-        parts = parsed_query.split(']')
-        left_part = parts.pop(0)
-        left_parts = left_part.split('[')
-        leaf = left_parts.pop()
-        pre_leaf = '['.join(left_parts)
-        post_leaf = ']'.join(parts)
-        leaf_as_list = leaf.replace("'", "").split(', ')
-        tmp_table_name = self.__create_tmp_table(leaf_as_list, cur)
-        return pre_leaf + tmp_table_name + post_leaf
+        cur.row_factory = lambda cursor, row: row[0]
+        return cur.fetchall()
 
     def find_all_relevant_notes(self, user_query: str) -> List[str]:
         """
@@ -164,15 +148,12 @@ class LogicalQueriesHandler:
         :return:
             IDs of matching notes
         """
-        parsed_query = self.__infer_precedence(user_query)
-        with contextlib.closing(sqlite3.connect(self.__path_to_db)) as conn:
-            with contextlib.closing(conn.cursor()) as cur:
-                while ']' in parsed_query:
-                    parsed_query = self.__replace_leaf_with_tmp_table(
-                        parsed_query, cur
-                    )
-                tmp_table_name = parsed_query.strip("'")
-                cur.execute(f"SELECT note_id FROM {tmp_table_name}")
-                query_result = cur.fetchall()
-                note_ids = [x[0] for x in query_result]
-        return note_ids
+        user_query = user_query.strip()
+        if SINGLE_TAG_PATTERN.fullmatch(user_query):
+            return self.__find_notes_by_single_tag(user_query)
+        parsed_query = self.__parse_query(user_query)
+        query, params = self.__compile_node(parsed_query)
+        self.__validate_tags(self.__collect_tags(parsed_query))
+        cur = self.__connection.execute(query, params)
+        cur.row_factory = lambda cursor, row: row[0]
+        return cur.fetchall()
@@ -12,8 +12,15 @@ import hashlib
 from contextlib import contextmanager
 from typing import Dict, Generator, Any
 
-# Note that there must be no dependencies other than Python built-ins,
-# because this module is imported by scripts from `supplementaries`.
+# Note that there must be no required dependencies other than Python
+# built-ins, because this module is imported by scripts from
+# `supplementaries`. Faster third-party replacements may be used,
+# but only if absence of them is handled gracefully.
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 def extract_cells(path_to_dir: str) -> Generator[Dict[str, Any], None, None]:
@@ -25,15 +32,21 @@ def extract_cells(path_to_dir: str) -> Generator[Dict[str, Any], None, None]:
     :yield:
         cells as dictionaries
     """
-    file_names = [
-        x for x in os.listdir(path_to_dir)
-        if os.path.isfile(os.path.join(path_to_dir, x)) and not x.endswith('~')
-    ]
+    # `DirEntry.is_file` relies on file type reported by the directory
+    # itself, so there is no extra `stat` call per file.
+    with os.scandir(path_to_dir) as dir_entries:
+        file_names = [
+            x.name for x in dir_entries
+            if x.is_file() and not x.name.endswith('~')
+        ]
     for file_name in file_names:
-        with open(os.path.join(path_to_dir, file_name)) as source_file:
-            cells = json.load(source_file)['cells']
-            for cell in cells:
-                yield cell
+        with open(os.path.join(path_to_dir, file_name), 'rb') as source_file:
+            raw_content = source_file.read()
+        if orjson is not None:
+            cells = orjson.loads(raw_content)['cells']
+        else:
+            cells = json.loads(raw_content)['cells']
+        yield from cells
 
 
 def compress(string: str, max_length: int = 64) -> str:
@@ -6,45 +6,123 @@ Author: Nikolay Lysenko
 
 
 import os
+import re
 import sqlite3
-import contextlib
-from functools import reduce
-from typing import List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Generator, Iterable, List, Optional, Tuple, Union
 
-from flask import render_template, url_for, request
-from flask_misaka import Misaka
+import misaka
+from flask import (
+    Response, g, render_template, request, stream_with_context, url_for
+)
 from markupsafe import Markup
 
 from readingbricks import app, utils
 from readingbricks.user_query_processing import LogicalQueriesHandler
 
 
-markdown_preprocessor = Misaka()
-markdown_preprocessor.init_app(app)
+# Pre-constructed Hoedown renderer with extension flags resolved once
+# at import time, not on every `render` call.
+markdown_preprocessor = misaka.Markdown(
+    misaka.HtmlRenderer(),
+    extensions=('math', 'math-explicit', 'no-intra-emphasis')
+)
+
+# Misaka releases GIL inside its C code, so notes can be rendered
+# in parallel by threads.
+RENDER_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+VALID_QUERY_PATTERN = re.compile(r'[()A-Za-z_\u0080-\u07ff ]+')
+
+DB_CONNECTIONS = threading.local()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """
+    Return connection to SQLite database owned by the current thread.
+
+    A separate connection is kept per worker thread and per database
+    path. It is opened at the first call and then lives as long as the
+    thread does, so connection setup and SQLite page cache are not
+    thrown away after every request.
+    """
+    path_to_db = app.config.get('path_to_db')
+    connections = getattr(DB_CONNECTIONS, 'by_path', None)
+    if connections is None:
+        connections = {}
+        DB_CONNECTIONS.by_path = connections
+    conn = connections.get(path_to_db)
+    if conn is None:
+        # URIs (e.g., shared in-memory databases) must be passed
+        # with `uri=True`, plain filesystem paths must not.
+        conn = sqlite3.connect(path_to_db, uri=path_to_db.startswith('file:'))
+        # The database easily fits in RAM, so reads become direct
+        # memory accesses; the app never writes, so it is safe
+        # to turn `synchronous` off.
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA synchronous=OFF")
+        connections[path_to_db] = conn
+    return conn
+
+
+def get_home_url() -> str:
+    """Return URL of the app root, computed once per request."""
+    home_url = getattr(g, 'home_url', None)
+    if home_url is None:
+        home_url = url_for('index', _external=True)
+        g.home_url = home_url
+    return home_url
+
+
+@lru_cache(maxsize=8)
+def load_tags_with_counts(path: str, mtime: int) -> Tuple[Tuple[str, str]]:
+    """
+    Parse a TSV file with counts of tags.
+
+    The file is read in one call and parse results are memoized with
+    modification time of the file as a part of cache key.
+    """
+    with open(path, 'rb') as source_file:
+        data = source_file.read().decode('utf-8')
+    return tuple(
+        tuple(line.split('\t')) for line in data.splitlines()
+    )
+
+
+@lru_cache(maxsize=8)
+def render_tags_cloud_template(path: str, mtime: int) -> str:
+    """
+    Compose HTML of the tags cloud with placeholders instead of URLs.
+
+    HTML of all links is precomputed and memoized, so at request time
+    only the root URL is substituted with a single `str.replace`.
+    """
+    tags_with_counts = load_tags_with_counts(path, mtime)
+    return ''.join(
+        f'<a href=__home_url__/tags/{tag} class="button">'
+        f'{tag} ({count})</a>\n'
+        for tag, count in tags_with_counts
+    )
 
 
 @app.route('/')
 def index() -> str:
     """Render home page."""
-    tags_with_counts = []
     path_to_counts_of_tags = app.config.get('path_to_counts_of_tags')
-    with open(path_to_counts_of_tags) as source_file:
-        for line in source_file:
-            tags_with_counts.append(line.split('\t'))
-    home_url = url_for('index', _external=True)
-    link_names = [
-        f'{tag} ({count.strip()})' for (tag, count) in tags_with_counts
-    ]
-    links_to_tags = [
-        f'<a href={home_url}tags/{tag} class="button">{name}</a>\n'
-        for (tag, counts), name in zip(tags_with_counts, link_names)
-    ]
-    tags_cloud = Markup(''.join(links_to_tags))
-    content_with_css = render_template('index.html', **locals())
+    home_url = get_home_url()
+    links_to_tags = render_tags_cloud_template(
+        path_to_counts_of_tags, os.stat(path_to_counts_of_tags).st_mtime_ns
+    )
+    tags_cloud = Markup(activate_cross_links(links_to_tags, home_url))
+    content_with_css = render_template('index.html', tags_cloud=tags_cloud)
     return content_with_css
 
 
-def make_link_from_title(md_title: str) -> str:
+def make_link_from_title(md_title: str, home_url: str) -> str:
     """
     Convert Markdown title to Markdown title with link.
 
@@ -52,90 +130,210 @@ def make_link_from_title(md_title: str) -> str:
     '## Title' -> '## [Title](URL)'
     """
     note_title = md_title.lstrip('# ').rstrip('\n')
-    home_url = url_for('index', _external=True)
     result = '## ' + f'[{note_title}]({home_url}notes/{note_title})\n'
     return result
 
 
-def activate_cross_links(content_in_markdown: str) -> str:
+def activate_cross_links(content: str, home_url: str) -> str:
     """
     Make links to other notes valid.
 
     Substring '__home_url__' is reserved for links to the root of the
-    web app and here this substring is replaced with actual URL.
+    web app and here this substring is replaced with actual URL
+    in a single pass over the content.
     """
-    home_url = url_for('index', _external=True)
-    content_in_markdown = content_in_markdown.replace(
-        '__home_url__/', home_url
-    )
-    return content_in_markdown
+    return content.replace('__home_url__/', home_url)
 
 
-def convert_note_from_markdown_to_html(note_id: str) -> Optional[Markup]:
+@lru_cache(maxsize=4096)
+def render_note_in_html(note_id: str, mtime: int) -> str:
     """
-    Convert a Markdown file into `Markup` instance with HTML inside.
+    Render a Markdown file as HTML with URLs left as placeholders.
 
-    If requested note does not exist, return `None`.
+    Results are memoized and modification time of the file is a part
+    of cache key, so editing a note invalidates its cached rendering.
     """
     dir_path = app.config.get('path_to_markdown_notes')
     abs_requested_path = os.path.join(dir_path, f'{note_id}.md')
-    if not os.path.isfile(abs_requested_path):
-        return None
     with open(abs_requested_path, 'r') as source_file:
         md_title = source_file.readline()
-        md_title_as_link = make_link_from_title(md_title)
+        md_title_as_link = make_link_from_title(md_title, '__home_url__/')
         content_in_markdown = md_title_as_link + source_file.read()
-    content_in_markdown = activate_cross_links(content_in_markdown)
-    content_in_html = markdown_preprocessor.render(
-        content_in_markdown,
-        math=True, math_explicit=True, no_intra_emphasis=True
-    )
+    content_in_html = markdown_preprocessor(content_in_markdown)
+    # Misaka puts a blank line between a paragraph and a list that
+    # follows it; fix this once per note, before the result is cached.
+    content_in_html = content_in_html.replace('</p>\n\n<ul>', '</p>\n<ul>')
     return content_in_html
 
 
+def prerender_all_notes() -> None:
+    """
+    Render all existing notes before the first request comes.
+
+    Here, cache of `render_note_in_html` is warmed up, so pages are
+    composed from ready HTML pieces instead of rendering Markdown
+    notes per request. Also a mapping from note title to note ID is
+    collected, so requested titles are resolved by a dictionary lookup
+    instead of hashing.
+    """
+    dir_path = app.config.get('path_to_markdown_notes')
+    if not os.path.isdir(dir_path):
+        return
+    title_to_note_id = {}
+    for file_name in os.listdir(dir_path):
+        if not file_name.endswith('.md'):
+            continue
+        note_id = file_name[:-len('.md')]
+        file_path = os.path.join(dir_path, file_name)
+        with open(file_path, 'r') as source_file:
+            note_title = source_file.readline().lstrip('# ').rstrip('\n')
+        title_to_note_id[note_title] = note_id
+        render_note_in_html(note_id, os.stat(file_path).st_mtime_ns)
+    app.config['title_to_note_id'] = title_to_note_id
+
+
+def convert_note_from_markdown_to_html(
+        note_id: str, home_url: str
+) -> Optional[Markup]:
+    """
+    Convert a Markdown file into `Markup` instance with HTML inside.
+
+    If requested note does not exist, return `None`.
+    """
+    dir_path = app.config.get('path_to_markdown_notes')
+    abs_requested_path = os.path.join(dir_path, f'{note_id}.md')
+    try:
+        mtime = os.stat(abs_requested_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    content_in_html = render_note_in_html(note_id, mtime)
+    return Markup(activate_cross_links(content_in_html, home_url))
+
+
+@lru_cache(maxsize=4096)
+def render_note_page(note_id: str, note_title: str, mtime: int) -> str:
+    """
+    Render the whole page of a note with URLs left as placeholders.
+
+    A page of a note is immutable while its Markdown file stays the
+    same, so complete pages are memoized and a repeated request is
+    served with a single placeholder substitution.
+    """
+    content_in_html = Markup(render_note_in_html(note_id, mtime))
+    return render_template(
+        'regular_page.html',
+        page_title=note_title, content_in_html=content_in_html
+    )
+
+
 @app.route('/notes/<note_title>')
 def page_with_note(note_title: str) -> str:
     """Render in HTML a page with exactly one note."""
-    note_id = utils.compress(note_title)
-    content_in_html = convert_note_from_markdown_to_html(note_id)
-    if content_in_html is None:
+    note_id = app.config.get('title_to_note_id', {}).get(note_title)
+    if note_id is None:
+        # Either the note appeared after prerendering or it is absent.
+        note_id = utils.compress(note_title)
+    dir_path = app.config.get('path_to_markdown_notes')
+    abs_requested_path = os.path.join(dir_path, f'{note_id}.md')
+    try:
+        mtime = os.stat(abs_requested_path).st_mtime_ns
+    except FileNotFoundError:
         return render_template('404.html')
-    title = note_title
-    content_with_css = render_template('regular_page.html', **locals())
-    content_with_css = content_with_css.replace('</p>\n\n<ul>', '</p>\n<ul>')
-    return content_with_css
+    content_with_css = render_note_page(note_id, note_title, mtime)
+    return activate_cross_links(content_with_css, get_home_url())
 
 
-def page_for_list_of_ids(note_ids: List[str], page_title: str) -> str:
-    """Render in HTML a page with all notes from the specified list."""
-    notes_content = []
-    for note_id in note_ids:
-        notes_content.append(convert_note_from_markdown_to_html(note_id))
-    content_in_html = reduce(lambda x, y: x + y, notes_content)
-    content_with_css = render_template('regular_page.html', **locals())
-    content_with_css = content_with_css.replace('</p>\n\n<ul>', '</p>\n<ul>')
-    return content_with_css
+# Substring that marks the place of notes in a rendered page frame.
+NOTES_PLACEHOLDER = '__notes_content__'
+
+
+def stream_page_pieces(
+        head: str, notes_content: Iterable[Optional[Markup]], tail: str
+) -> Generator[str, None, None]:
+    """Yield pieces of a page in their order, skipping missing notes."""
+    yield head
+    for content in notes_content:
+        if content is not None:
+            yield content
+    yield tail
+
+
+def page_for_list_of_ids(note_ids: List[str], page_title: str) -> Response:
+    """
+    Render in HTML a page with all notes from the specified list.
+
+    The page is streamed to the client: its top part is sent
+    immediately and then each note follows as soon as it is rendered,
+    so time-to-first-byte does not depend on the number of notes.
+    """
+    home_url = get_home_url()
+    frame = render_template(
+        'regular_page.html',
+        page_title=page_title, content_in_html=Markup(NOTES_PLACEHOLDER)
+    )
+    head, _, tail = frame.partition(NOTES_PLACEHOLDER)
+
+    def render_one(note_id: str) -> Optional[Markup]:
+        # Bind the precomputed root URL to the converting function.
+        return convert_note_from_markdown_to_html(note_id, home_url)
+
+    if len(note_ids) < 4:
+        # Dispatching to the pool does not pay off for a few notes.
+        notes_content = map(render_one, note_ids)
+    else:
+        notes_content = RENDER_POOL.map(render_one, note_ids)
+    pieces = stream_page_pieces(head, notes_content, tail)
+    return Response(stream_with_context(pieces))
 
 
 @app.route('/tags/<tag>')
-def page_for_tag(tag: str) -> str:
+def page_for_tag(tag: str) -> Union[str, Response]:
     """Render in HTML a page with all notes that have the specified tag."""
-    path_to_db = app.config.get('path_to_db')
-    try:
-        with contextlib.closing(sqlite3.connect(path_to_db)) as conn:
-            with contextlib.closing(conn.cursor()) as cur:
-                cur.execute(f"SELECT note_id FROM {tag}")
-                query_result = cur.fetchall()
-        note_ids = [x[0] for x in query_result]
-    except sqlite3.OperationalError:
+    conn = get_db_connection()
+    cur = conn.execute(
+        "SELECT note_id FROM tag_to_notes WHERE tag = ?",
+        (tag,)
+    )
+    cur.row_factory = lambda cursor, row: row[0]
+    note_ids = cur.fetchall()
+    if not note_ids:
         return render_template('404.html')
     page_title = (tag[0].upper() + tag[1:]).replace('_', ' ')
     content_with_css = page_for_list_of_ids(note_ids, page_title)
     return content_with_css
 
 
+def get_db_mtime(path_to_db: str) -> float:
+    """
+    Return modification time of the database file.
+
+    A URI of an in-memory database has no file behind it; such a
+    database never changes while the app is running, so a constant
+    is returned for it.
+    """
+    try:
+        return os.path.getmtime(path_to_db)
+    except OSError:
+        return 0.0
+
+
+@lru_cache(maxsize=512)
+def find_note_ids_for_query(
+        user_query: str, path_to_db: str, db_mtime: float
+) -> Tuple[str, ...]:
+    """
+    Return IDs of notes that match the query.
+
+    Results are memoized, so a repeated query costs nothing.
+    Modification time of the database file is a part of cache key
+    and so stale entries are not returned after the database update.
+    """
+    query_handler = LogicalQueriesHandler(get_db_connection())
+    return tuple(query_handler.find_all_relevant_notes(user_query))
+
+
 @app.route('/query', methods=['POST'])
-def page_for_query() -> str:
+def page_for_query() -> Union[str, Response]:
     """
     Render in HTML a page with all notes that match user query.
 
@@ -144,19 +342,28 @@ def page_for_query() -> str:
     user_query = request.form['query']
     default = "нейронные_сети AND (постановка_задачи OR байесовские_методы)"
     user_query = user_query or default
+    # Queries that differ only in whitespace share one cache entry.
+    normalized_query = ' '.join(user_query.split())
+    if not VALID_QUERY_PATTERN.fullmatch(normalized_query):
+        return render_template('invalid_query.html', user_query=user_query)
     path_to_db = app.config.get('path_to_db')
-    query_handler = LogicalQueriesHandler(path_to_db)
     try:
-        note_ids = query_handler.find_all_relevant_notes(user_query)
+        note_ids = find_note_ids_for_query(
+            normalized_query, path_to_db, get_db_mtime(path_to_db)
+        )
     except sqlite3.OperationalError:
-        content_with_css = render_template('invalid_query.html', **locals())
+        content_with_css = render_template(
+            'invalid_query.html', user_query=user_query
+        )
         return content_with_css
     if len(note_ids) > 0:
         content_with_css = page_for_list_of_ids(
             note_ids, page_title=user_query
         )
     else:
-        content_with_css = render_template('empty_result.html', **locals())
+        content_with_css = render_template(
+            'empty_result.html', user_query=user_query
+        )
     return content_with_css
 
 
@@ -7,7 +7,9 @@ Author: Nikolay Lysenko
 
 from readingbricks import app
 from readingbricks.resources import provide_resources
+from readingbricks.views import prerender_all_notes
 
 
 provide_resources()
+prerender_all_notes()
 app.run(debug=True)
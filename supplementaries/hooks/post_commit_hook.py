@@ -17,33 +17,28 @@ import os
 import subprocess
 
 
+# Both paths are computed once at import time; `normpath` resolves
+# the `..` components so that they are not re-walked by every syscall.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.normpath(os.path.join(SCRIPT_DIR, '../../'))
+
+
 def main():
     """
     Add to the current commit files that were added to the next commit.
 
     Note that these files must be added beforehand by pre-commit hook.
     """
-    # Break infinite recursion with disabling post-commit hooks.
-    subprocess.run(
-        '[ -x {file} ] && chmod -x {file}'.format(file=__file__),
-        shell=True
-    )
-
-    # Edit current commit.
-    relative_path = '../../'
-    script_directory = os.path.dirname(__file__)
-    absolute_path = os.path.join(script_directory, relative_path)
-    subprocess.run(
-        'git commit --amend',
-        cwd=absolute_path,
-        shell=True
-    )
-
-    # Enable post-commit hooks again.
-    subprocess.run(
-        'chmod +x {file}'.format(file=__file__),
-        shell=True
-    )
+    # Disabling of post-commit hooks breaks infinite recursion and
+    # enabling of them restores the initial state. Permissions are
+    # managed with `os.chmod` and `git` is called without a shell,
+    # because each extra process spawn adds latency to every commit.
+    initial_mode = os.stat(__file__).st_mode
+    os.chmod(__file__, initial_mode & ~0o111)
+    try:
+        subprocess.run(['git', 'commit', '--amend'], cwd=REPO_ROOT)
+    finally:
+        os.chmod(__file__, initial_mode)
 
 
 if __name__ == '__main__':
@@ -21,36 +21,140 @@ Author: Nikolay Lysenko
 """
 
 
+import json
 import os
+import pickle
 import subprocess
-import sys
 from collections import Counter
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Generator, List, Set
 
 
-def convert_to_absolute_path(relative_path: str) -> str:
-    """Convert relative path to absolute path."""
-    script_directory = os.path.dirname(__file__)
-    absolute_path = os.path.join(script_directory, relative_path)
-    return absolute_path
+# Bump it after any change in structure of cached data.
+CACHE_VERSION = 1
+
+# Both paths are computed once at import time; `normpath` resolves
+# the `..` components so that they are not re-walked by every syscall.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.normpath(os.path.join(SCRIPT_DIR, '../../'))
 
 
 def lint() -> None:
     """Analyze code statically."""
-    rel_path_to_repo_root = '../../'
-    abs_path_to_repo_root = convert_to_absolute_path(rel_path_to_repo_root)
-    result = subprocess.run('make lint', cwd=abs_path_to_repo_root, shell=True)
+    result = subprocess.run(['make', 'lint'], cwd=REPO_ROOT)
     return_code = result.returncode
     if return_code:
         raise ValueError('Lint target failed.')
 
 
+def load_cells_cache(path_to_cache: str) -> Dict[str, Any]:
+    """Load cache of parsed cells or create an empty one."""
+    try:
+        with open(path_to_cache, 'rb') as cache_file:
+            cache = pickle.load(cache_file)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except Exception:
+        # The cache is an expendable byproduct, so any way in which
+        # it can be broken (e.g., truncation by an interrupted hook
+        # raising `EOFError`) means starting from an empty one.
+        pass
+    return {'version': CACHE_VERSION, 'files': {}}
+
+
+def collect_notebook_mtimes(path_to_dir: str) -> Dict[str, int]:
+    """Map paths of notebooks to their modification times."""
+    result = {}
+    for file_name in sorted(os.listdir(path_to_dir)):
+        file_path = os.path.join(path_to_dir, file_name)
+        if file_name.endswith('.ipynb') and os.path.isfile(file_path):
+            result[file_path] = os.stat(file_path).st_mtime_ns
+    return result
+
+
+def parse_notebook(file_path: str) -> Any:
+    """Read cells of a notebook."""
+    with open(file_path, 'rb') as source_file:
+        return json.loads(source_file.read())['cells']
+
+
+def parse_notebooks(file_paths: List[str]) -> List[Any]:
+    """Parse notebooks, in parallel if there are many of them."""
+    if len(file_paths) > 4:
+        # JSON decoding is CPU-bound and files are independent,
+        # but pool startup does not pay off for a few files.
+        with ProcessPoolExecutor() as executor:
+            return list(executor.map(parse_notebook, file_paths))
+    return [parse_notebook(file_path) for file_path in file_paths]
+
+
+def save_cells_cache(
+        cache: Dict[str, Any],
+        fresh_files: Dict[str, Any],
+        path_to_cache: str
+) -> None:
+    """Persist cache of parsed cells if anything has changed."""
+    if fresh_files != cache['files']:
+        cache['files'] = fresh_files
+        # Content goes to a temporary file first and then the file is
+        # renamed atomically, so an interrupted hook can not leave the
+        # cache half-written.
+        temporary_path = path_to_cache + '.tmp'
+        with open(temporary_path, 'wb') as cache_file:
+            pickle.dump(cache, cache_file)
+        os.replace(temporary_path, path_to_cache)
+
+
+def refresh_cells_cache(
+        path_to_dir: str, path_to_cache: str
+) -> Dict[str, Any]:
+    """Return up-to-date mapping from notebook path to its cells."""
+    cache = load_cells_cache(path_to_cache)
+    mtimes = collect_notebook_mtimes(path_to_dir)
+    stale_paths = [
+        file_path for file_path, mtime in mtimes.items()
+        if cache['files'].get(file_path, (None, None))[0] != mtime
+    ]
+    parsed = dict(zip(stale_paths, parse_notebooks(stale_paths)))
+    fresh_files = {
+        file_path:
+            (mtime, parsed[file_path]) if file_path in parsed
+            else cache['files'][file_path]
+        for file_path, mtime in mtimes.items()
+    }
+    save_cells_cache(cache, fresh_files, path_to_cache)
+    return fresh_files
+
+
+def extract_cells_with_cache(
+        path_to_dir: str, path_to_cache: str
+) -> Generator[Dict[str, Any], None, None]:
+    """
+    Walk through directory and yield cells of notebooks from there.
+
+    Parsed cells are cached on disk with file modification times as
+    keys, so only notebooks changed since the previous commit are
+    parsed again. Users wait for this script at every commit and so
+    repeated parsing of untouched notebooks is avoided.
+
+    :param path_to_dir:
+        path to source directory with Jupyter notebooks
+    :param path_to_cache:
+        path to pickle file with cells parsed at previous runs
+    :yield:
+        cells as dictionaries
+    """
+    for _, cells in refresh_cells_cache(path_to_dir, path_to_cache).values():
+        yield from cells
+
+
 def validate_cell_header(
-        headers: List[str], cell: Dict[str, Any]
-) -> List[str]:
+        headers: Set[str], cell: Dict[str, Any]
+) -> None:
     """Check that header of a cell meets project specifications."""
-    content = [line.rstrip('\n') for line in cell['source']]
-    curr_header = content[0]
+    # Only the first line is needed, so the other lines of the cell
+    # are not copied and stripped in vain.
+    curr_header = cell['source'][0].rstrip('\n') if cell['source'] else ''
 
     msg = f"Cell header must be h2 (i.e. start with ##), found: {curr_header}"
     if not curr_header.startswith('## '):
@@ -60,8 +164,7 @@ def validate_cell_header(
     if curr_header in headers:
         raise ValueError(msg)
 
-    headers.append(curr_header)
-    return headers
+    headers.add(curr_header)
 
 
 def validate_tag(tag: str) -> None:
@@ -74,72 +177,94 @@ def validate_tag(tag: str) -> None:
         raise ValueError("Tags must not start with digit")
 
 
-def update_list_of_tags(tags: List[str], cell: Dict[str, Any]) -> List[str]:
-    """Update list of tags occurrences based on a current cell."""
+def update_counter_of_tags(tags: Counter, cell: Dict[str, Any]) -> None:
+    """Update counter of tags occurrences based on a current cell."""
     current_tags = cell['metadata']['tags']
     for tag in current_tags:
         validate_tag(tag)
-    tags.extend(current_tags)
-    return tags
+    tags.update(current_tags)
 
 
-def write_tag_counts(tags: List[str], absolute_path: str) -> None:
+def write_tag_counts(tags: Counter, absolute_path: str) -> None:
     """Overwrite previous content of the file with tag statistics."""
-    counter_of_tags = Counter(tags)
-    tags_and_counts = counter_of_tags.most_common()
     sorted_tags_and_counts = sorted(
-        tags_and_counts,
+        tags.items(),
         key=lambda tag_and_count: (-tag_and_count[1], tag_and_count[0])
     )
-    with open(absolute_path, 'w') as out_file:
-        for tag, count in sorted_tags_and_counts:
-            out_file.write(f'{tag}\t{count}\n')
+    payload = ''.join(
+        f'{tag}\t{count}\n' for tag, count in sorted_tags_and_counts
+    )
+    # Content goes to a temporary file first and then the file is
+    # renamed atomically, so an interrupted hook can not leave the
+    # statistics half-written.
+    temporary_path = absolute_path + '.tmp'
+    with open(temporary_path, 'w') as out_file:
+        out_file.write(payload)
+    os.replace(temporary_path, absolute_path)
 
 
-def add_to_commit(path_from_git_root: str) -> None:
+def add_to_commit(paths_from_git_root: List[str]) -> None:
     """
-    Add file or directory to the next commit.
+    Add files or directories to the next commit.
 
-    Then post-commit hook will commit it and transfer
+    Then post-commit hook will commit them and transfer
     to the current commit before push.
+
+    All paths are passed to a single `git add` call without a shell,
+    because each extra process spawn adds latency to every commit.
     """
     # `git add ..` can not be run from `.git/*`,
     # because this directory is outside of work tree.
-    cwd_relative_path = '../../'
-    cwd_absolute_path = convert_to_absolute_path(cwd_relative_path)
     subprocess.run(
-        'git add {}'.format(path_from_git_root),
-        cwd=cwd_absolute_path,  # Run above command from top level of the repo.
-        shell=True
+        ['git', 'add'] + paths_from_git_root,
+        cwd=REPO_ROOT,  # Run above command from top level of the repo.
+    )
+
+
+def list_staged_paths() -> List[str]:
+    """List repo-root-relative paths staged for the current commit."""
+    # Deletions are included, because removing a notebook changes tag
+    # counts just like editing one does.
+    output = subprocess.check_output(
+        ['git', 'diff', '--cached', '--name-only', '--diff-filter=ACMRD'],
+        cwd=REPO_ROOT
     )
+    return output.decode().splitlines()
 
 
 def main():
     """Manage updates."""
     lint()
 
-    relative_paths = {
-        'source': '../../notes/',
-        'counts': '../../supplementaries/counts_of_tags.tsv'
+    if not any(x.startswith('notes/') for x in list_staged_paths()):
+        # Tag counts and note validity can not be affected by commits
+        # that do not touch notes, so the corpus scan is skipped.
+        return
+
+    # Paths are stored relative to the repository root, because
+    # `git add` needs them in exactly this form. Note that `lstrip`
+    # must not be used for trimming a prefix: it trims a set of
+    # characters instead.
+    paths_from_git_root = {
+        'source': 'notes/',
+        'counts': 'supplementaries/counts_of_tags.tsv',
+        'cache': '.git/readingbricks_cache.pkl'
     }
     absolute_paths = {
-        k: convert_to_absolute_path(v) for k, v in relative_paths.items()
+        k: os.path.join(REPO_ROOT, v)
+        for k, v in paths_from_git_root.items()
     }
 
-    sys.path.append(
-        convert_to_absolute_path('../../readingbricks/')
+    headers = set()
+    tags = Counter()
+    cells = extract_cells_with_cache(
+        absolute_paths['source'], absolute_paths['cache']
     )
-    import utils
-
-    headers = []
-    tags = []
-    for cell in utils.extract_cells(absolute_paths['source']):
-        headers = validate_cell_header(headers, cell)
-        tags = update_list_of_tags(tags, cell)
+    for cell in cells:
+        validate_cell_header(headers, cell)
+        update_counter_of_tags(tags, cell)
     write_tag_counts(tags, absolute_paths['counts'])
-    for path in [v.lstrip('../../')
-                 for k, v in relative_paths.items() if k != 'source']:
-        add_to_commit(path)
+    add_to_commit([paths_from_git_root['counts']])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+"""
+Shared fixtures for tests.
+
+Author: Nikolay Lysenko
+"""
+
+
+import contextlib
+import pathlib
+import sqlite3
+from typing import Generator
+
+import pytest
+from flask.testing import FlaskClient
+
+from readingbricks import app
+from readingbricks.resources import provide_resources
+
+
+# It is resolved once, so path arithmetic below is pure string work.
+TESTS_DIR = pathlib.Path(__file__).resolve().parent
+
+
+# The annotation is a string, because `pytest.TempPathFactory` is not
+# exported from the `pytest` namespace in the pinned pytest version.
+@pytest.fixture(scope='session')
+def test_client(
+        tmp_path_factory: 'pytest.TempPathFactory'
+) -> Generator[FlaskClient, None, None]:
+    """
+    Provide Flask test client.
+
+    Resources are built and the app is configured once per session,
+    because all tests only read them. Built resources go to temporary
+    directories that are unique per `pytest-xdist` worker, so parallel
+    workers do not contend on one SQLite file; source notebooks and
+    tag counts are shared, because they are only read.
+    """
+    app.testing = True
+
+    # Templates do not change while tests are running, so they are
+    # compiled once and never re-checked; the unbounded dict keeps
+    # every compiled template for the whole session.
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+    app.jinja_env.cache = {}
+
+    ipynb_path = str(TESTS_DIR / 'resources' / 'sample_notebooks')
+    markdown_path = str(tmp_path_factory.mktemp('markdown_notes'))
+    db_path = str(tmp_path_factory.mktemp('db') / 'tag_to_notes.db')
+    counts_path = str(TESTS_DIR / 'resources' / 'counts_of_tags.tsv')
+
+    provide_resources(ipynb_path, markdown_path, db_path)
+
+    # The built database is copied into a shared in-memory one, so
+    # the many queries of the suite never go to disk. The keeping
+    # connection holds the in-memory database alive for the session.
+    memory_db_uri = 'file:tag_to_notes?mode=memory&cache=shared'
+    keeping_connection = sqlite3.connect(memory_db_uri, uri=True)
+    with contextlib.closing(sqlite3.connect(db_path)) as disk_connection:
+        disk_connection.backup(keeping_connection)
+
+    app.config['path_to_ipynb_notes'] = ipynb_path
+    app.config['path_to_markdown_notes'] = markdown_path
+    app.config['path_to_db'] = memory_db_uri
+    app.config['path_to_counts_of_tags'] = counts_path
+
+    # The client is entered once, so its context is reused by all
+    # requests of the session instead of being rebuilt per call.
+    with app.test_client() as client:
+        yield client
+    keeping_connection.close()
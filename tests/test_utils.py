@@ -5,19 +5,22 @@ Author: Nikolay Lysenko
 """
 
 
+import pathlib
 import unittest
-import os
 
 from readingbricks import utils
 
 
+# It is resolved once, so path arithmetic below is pure string work.
+TESTS_DIR = pathlib.Path(__file__).resolve().parent
+
+
 class TestJupyterCellsExtraction(unittest.TestCase):
     """Tests of tools for iterating over Jupyter cells."""
 
     def test_extract_cells(self) -> None:
         """Test `extract_cells` function."""
-        dir_path = os.path.dirname(__file__)
-        path = os.path.join(dir_path, 'resources/sample_notebooks')
+        path = str(TESTS_DIR / 'resources' / 'sample_notebooks')
         result = list(utils.extract_cells(path))
         letters_content = sorted(
             [
@@ -48,21 +51,3 @@ class TestJupyterCellsExtraction(unittest.TestCase):
             ['## 2\n', '\n', '2']
         ]
         self.assertEqual(digits_content, true_digits_content)
-
-
-def main():
-    """Run tests."""
-    test_loader = unittest.TestLoader()
-    suites_list = []
-    testers = [
-        TestJupyterCellsExtraction()
-    ]
-    for tester in testers:
-        suite = test_loader.loadTestsFromModule(tester)
-        suites_list.append(suite)
-    overall_suite = unittest.TestSuite(suites_list)
-    unittest.TextTestRunner().run(overall_suite)
-
-
-if __name__ == '__main__':
-    main()
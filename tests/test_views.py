@@ -5,174 +5,208 @@ Author: Nikolay Lysenko
 """
 
 
-import unittest
-import os
+import re
+from functools import lru_cache
+from typing import Set, Tuple
 
-from readingbricks import app
-from readingbricks.resources import provide_resources
+from flask.testing import FlaskClient
 
 
-class TestViews(unittest.TestCase):
-    """Tests of functions for rendering pages in HTML."""
+TITLE_TEMPLATE = (
+    '<h2><a href="http://localhost/notes/{title}">{title}</a></h2>'
+)
+
+# Expected patterns are encoded once at import time and looked up in
+# raw response bodies, so no response is decoded from UTF-8 in vain.
+NOT_FOUND_TITLE = '<title>Страница не найдена</title>'.encode('utf-8')
+NOT_FOUND_TEXT = 'Страница не найдена.'.encode('utf-8')
+NOTHING_FOUND = 'h2>Ничего не найдено</h2>'.encode('utf-8')
+INVALID_QUERY = '<h2>Запрос не может быть обработан</h2>'.encode('utf-8')
+
+
+@lru_cache(maxsize=None)
+def make_encoded_title(title: str) -> bytes:
+    """
+    Render HTML title of a note as UTF-8 bytes.
+
+    Results are memoized, because the same few titles are checked
+    against many responses across the suite.
+    """
+    return TITLE_TEMPLATE.format(title=title).encode('utf-8')
+
+
+@lru_cache(maxsize=None)
+def compile_patterns_matcher(patterns: Tuple[bytes, ...]) -> 're.Pattern':
+    """Compile a regex that matches any of the literal patterns."""
+    return re.compile(b'|'.join(map(re.escape, patterns)))
+
+
+def match_patterns(body: bytes, patterns: Tuple[bytes, ...]) -> Set[bytes]:
+    """
+    Find which of the patterns occur in the body.
+
+    All patterns are looked up in a single pass over the body
+    instead of one linear scan per pattern.
+    """
+    return set(compile_patterns_matcher(patterns).findall(body))
+
+
+_BODY_CACHE = {}
+
+
+def fetch_body(test_client: FlaskClient, url: str, query: str = None) -> bytes:
+    """
+    Return response body for a URL, caching it within the session.
+
+    Pages are immutable while tests are running, so repeated requests
+    to the same URL with the same query share one response body.
+    """
+    key = (url, query)
+    body = _BODY_CACHE.get(key)
+    if body is None:
+        if query is None:
+            body = test_client.get(url).data
+        else:
+            body = test_client.post(url, data={'query': query}).data
+        _BODY_CACHE[key] = body
+    return body
+
+
+def check_patterns(
+        body: bytes,
+        included: Tuple[bytes, ...],
+        absent: Tuple[bytes, ...] = ()
+) -> None:
+    """
+    Check that the body has all included patterns and no absent ones.
+
+    All violations are collected before the assertion, so a failure
+    reports every missing and every unexpected pattern at once.
+    """
+    found = match_patterns(body, included + absent)
+    missing = [pattern for pattern in included if pattern not in found]
+    unexpected = [pattern for pattern in absent if pattern in found]
+    assert not missing and not unexpected, (missing, unexpected)
+
+
+def test_home_page(test_client: FlaskClient) -> None:
+    """Test home page."""
+    body = fetch_body(test_client, '/')
+    check_patterns(body, (b'letters (4)', b'digits (2)', b'list (1)'))
+
+
+def test_default_page(test_client: FlaskClient) -> None:
+    """Test page that is shown when requested page is not found."""
+    response = test_client.get('/non_existing')
+    assert NOT_FOUND_TITLE in response.data
+    assert response.status_code == 404
+
+
+def test_page_for_note(test_client: FlaskClient) -> None:
+    """Test page with a single note."""
+    check_patterns(
+        fetch_body(test_client, '/notes/C'),
+        included=(
+            b'C:',
+            b'<li><p><em>c</em></p></li>',
+            b'<li><p>\\(c\\)</p></li>',
+            b'<a href="http://localhost/notes/B">link</a>'
+        ),
+        absent=(make_encoded_title('A'),)
+    )
+    assert NOT_FOUND_TEXT in fetch_body(test_client, '/notes/non_existing')
+
+
+def test_page_for_tag(test_client: FlaskClient) -> None:
+    """Test page with all notes tagged with a specified tag."""
+    check_patterns(
+        fetch_body(test_client, '/tags/digits'),
+        included=(make_encoded_title('1'),),
+        absent=(make_encoded_title('A'),)
+    )
+    check_patterns(
+        fetch_body(test_client, '/tags/list'),
+        included=(make_encoded_title('C'),),
+        absent=(make_encoded_title('A'),)
+    )
+    assert NOT_FOUND_TEXT in fetch_body(test_client, '/tags/non_existing')
+
+
+def test_page_for_query_with_and(test_client: FlaskClient) -> None:
+    """Test search bar requests with AND operator."""
+    query = 'list AND letters'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(
+            b'C:',
+            b'<li><p><em>c</em></p></li>',
+            b'<li><p>\\(c\\)</p></li>'
+        ),
+        absent=(make_encoded_title('1'),)
+    )
+
+    query = 'list AND digits'
+    result = fetch_body(test_client, '/query', query)
+    assert NOTHING_FOUND in result
+
+
+def test_page_for_query_with_or(test_client: FlaskClient) -> None:
+    """Test search bar requests with OR operator."""
+    query = 'list OR letters'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('A'), b'<li><p><em>c</em></p></li>'),
+        absent=(make_encoded_title('1'),)
+    )
+
+    query = 'list OR digits'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('1'), b'<li><p><em>c</em></p></li>'),
+        absent=(make_encoded_title('A'),)
+    )
+
+
+def test_page_for_query_with_not(test_client: FlaskClient) -> None:
+    """Test search bar requests with NOT operator."""
+    query = 'NOT list'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('A'), b'<p>1</p>'),
+        absent=(make_encoded_title('C'),)
+    )
+
+    query = 'NOT letters'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('1'), b'<p>2</p>'),
+        absent=(make_encoded_title('A'),)
+    )
+
+
+def test_page_for_complex_query(test_client: FlaskClient) -> None:
+    """Test search bar requests with NOT, AND, and OR operators."""
+    query = '(list AND letters) OR (digits AND letters)'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('C'), b'<li><p><em>c</em></p></li>'),
+        absent=(make_encoded_title('B'), make_encoded_title('1'))
+    )
+
+    query = '(list AND letters) AND ((digits OR letters OR list) OR list)'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('C'), b'<li><p><em>c</em></p></li>'),
+        absent=(make_encoded_title('B'), make_encoded_title('1'))
+    )
 
-    title_template = (
-        '<h2><a href="http://localhost/notes/{title}">{title}</a></h2>'
+    query = 'digits OR NOT (letters AND NOT list)'
+    check_patterns(
+        fetch_body(test_client, '/query', query),
+        included=(make_encoded_title('1'), b'<li><p><em>c</em></p></li>'),
+        absent=(make_encoded_title('A'), make_encoded_title('D'))
     )
 
-    @classmethod
-    def setUpClass(cls) -> None:
-        """Do preparations that must be done once before all tests."""
-        app.testing = True
-
-        dir_path = os.path.dirname(__file__)
-        ipynb_path = os.path.join(dir_path, 'resources/sample_notebooks')
-        markdown_path = os.path.join(dir_path, '.markdown_notes')
-        db_path = os.path.join(dir_path, 'tag_to_notes.db')
-        counts_path = os.path.join(dir_path, 'resources/counts_of_tags.tsv')
-
-        provide_resources(ipynb_path, markdown_path, db_path)
-
-        app.config['path_to_ipynb_notes'] = ipynb_path
-        app.config['path_to_markdown_notes'] = markdown_path
-        app.config['path_to_db'] = db_path
-        app.config['path_to_counts_of_tags'] = counts_path
-
-    def setUp(self) -> None:
-        """Do preparations that must be done before each test."""
-        self.app = app.test_client()
-
-    def test_home_page(self) -> None:
-        """Test home page."""
-        result = self.app.get('/').data.decode('utf-8')
-        self.assertTrue('letters (4)' in result)
-        self.assertTrue('digits (2)' in result)
-        self.assertTrue('list (1)' in result)
-
-    def test_default_page(self) -> None:
-        """Test page that is shown when requested page is not found."""
-        response = self.app.get('/non_existing')
-        result = response.data.decode('utf-8')
-        status_code = response.status_code
-        self.assertTrue('<title>Страница не найдена</title>' in result)
-        self.assertEqual(status_code, 404)
-
-    def test_page_for_note(self) -> None:
-        """Test page with a single note."""
-        result = self.app.get('/notes/C').data.decode('utf-8')
-        self.assertTrue('C:' in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-        self.assertTrue('<li><p>\\(c\\)</p></li>' in result)
-        html_link = '<a href="http://localhost/notes/B">link</a>'
-        self.assertTrue(html_link in result)
-        self.assertFalse(self.title_template.format(title='A') in result)
-        result = self.app.get('/notes/non_existing').data.decode('utf-8')
-        self.assertTrue('Страница не найдена.' in result)
-
-    def test_page_for_tag(self) -> None:
-        """Test page with all notes tagged with a specified tag."""
-        result = self.app.get('/tags/digits').data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='1') in result)
-        self.assertFalse(self.title_template.format(title='A') in result)
-
-        result = self.app.get('/tags/list').data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='C') in result)
-        self.assertFalse(self.title_template.format(title='A') in result)
-
-        result = self.app.get('/tags/non_existing').data.decode('utf-8')
-        self.assertTrue('Страница не найдена.' in result)
-
-    def test_page_for_query_with_and(self) -> None:
-        """Test search bar requests with AND operator."""
-        query = 'list AND letters'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue('C:' in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-        self.assertTrue('<li><p>\\(c\\)</p></li>' in result)
-        self.assertFalse(self.title_template.format(title='1') in result)
-
-        query = 'list AND digits'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue('h2>Ничего не найдено</h2>' in result)
-
-    def test_page_for_query_with_or(self) -> None:
-        """Test search bar requests with OR operator."""
-        query = 'list OR letters'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='A') in result)
-        self.assertFalse(self.title_template.format(title='1') in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-
-        query = 'list OR digits'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertFalse(self.title_template.format(title='A') in result)
-        self.assertTrue(self.title_template.format(title='1') in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-
-    def test_page_for_query_with_not(self) -> None:
-        """Test search bar requests with NOT operator."""
-        query = 'NOT list'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='A') in result)
-        self.assertFalse(self.title_template.format(title='C') in result)
-        self.assertTrue('<p>1</p>' in result)
-
-        query = 'NOT letters'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertFalse(self.title_template.format(title='A') in result)
-        self.assertTrue(self.title_template.format(title='1') in result)
-        self.assertTrue('<p>2</p>' in result)
-
-    def test_page_for_complex_query(self) -> None:
-        """Test search bar requests with NOT, AND, and OR operators."""
-        query = '(list AND letters) OR (digits AND letters)'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='C') in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-        self.assertFalse(self.title_template.format(title='B') in result)
-        self.assertFalse(self.title_template.format(title='1') in result)
-
-        query = '(list AND letters) AND ((digits OR letters OR list) OR list)'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='C') in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-        self.assertFalse(self.title_template.format(title='B') in result)
-        self.assertFalse(self.title_template.format(title='1') in result)
-
-        query = 'digits OR NOT (letters AND NOT list)'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue(self.title_template.format(title='1') in result)
-        self.assertTrue('<li><p><em>c</em></p></li>' in result)
-        self.assertFalse(self.title_template.format(title='A') in result)
-        self.assertFalse(self.title_template.format(title='D') in result)
-
-        query = '(list AND letters) AND ((digits OR letters OR list) OR lists)'
-        response = self.app.post('/query', data={'query': query})
-        result = response.data.decode('utf-8')
-        self.assertTrue('<h2>Запрос не может быть обработан</h2>' in result)
-
-
-def main():
-    """Run tests."""
-    test_loader = unittest.TestLoader()
-    suites_list = []
-    testers = [
-        TestViews()
-    ]
-    for tester in testers:
-        suite = test_loader.loadTestsFromModule(tester)
-        suites_list.append(suite)
-    overall_suite = unittest.TestSuite(suites_list)
-    unittest.TextTestRunner().run(overall_suite)
-
-
-if __name__ == '__main__':
-    main()
+    query = '(list AND letters) AND ((digits OR letters OR list) OR lists)'
+    result = fetch_body(test_client, '/query', query)
+    assert INVALID_QUERY in result